@@ -1,6 +1,9 @@
+import builtins
+import functools
 import inspect
 import openai
 import string
+import types
 
 
 def identity_handler(expanded_template):
@@ -28,11 +31,92 @@ def template_function_with_handler(name, handler, format_string):
     ]
     sig = inspect.Signature(params)
 
-    def func(*args, **kwargs):
-        bound_values = sig.bind(*args, **kwargs)
-        expanded_template = format_string.format(**bound_values.arguments)
-        return handler(expanded_template)
+    # fields named like the generated function's globals would shadow them
+    if "_format" not in fields and "_handler" not in fields:
+        code = _compile_template(
+            format_string, tuple(fields), handler is not identity_handler
+        )
+        func = types.FunctionType(
+            code,
+            {
+                "_format": format_string.format_map,
+                "_handler": handler,
+                "__builtins__": builtins,
+            },
+        )
+    else:
+        func = _bind_template(name, handler, format_string, fields, sig)
 
     func.__signature__ = sig
     func.__name__ = name
+    func.__qualname__ = name
+    return func
+
+
+# Templates are usually defined once at start up, but applications that build them
+# dynamically must not keep a code object alive for every string ever seen.
+@functools.lru_cache(maxsize=256)
+def _compile_template(format_string, fields, with_handler):
+    # Generates code for a function whose parameters are exactly the template fields,
+    # e.g. def template(greeting, name): return f'{greeting}' ', ' f'{name}' '!'.
+    # Python's own argument handling then does all the binding and error reporting,
+    # and the template is parsed once here rather than by str.format on every call.
+    expression = _template_expression(format_string)
+    if expression is None:
+        # templates an f-string can't express exactly fall back to format_map
+        mapping = ", ".join(f"{field!r}: {field}" for field in fields)
+        expression = f"_format({{{mapping}}})"
+    if with_handler:
+        expression = f"_handler({expression})"
+    source = f"def template({', '.join(fields)}):\n    return {expression}\n"
+
+    namespace = {}
+    exec(source, namespace)
+    return namespace["template"].__code__
+
+
+def _template_expression(format_string):
+    # Returns the template as adjacent string literals and single field f-strings,
+    # which the compiler joins into one string build, or None if a field is
+    # positional, uses a nested format spec or an unknown conversion, or contains
+    # characters that would need escaping inside an f-string.
+    parts = []
+    for literal, field, spec, conversion in string.Formatter().parse(format_string):
+        if literal:
+            parts.append(repr(literal))
+        if field is None:
+            continue
+        if not field.isidentifier():
+            return None
+        if conversion is not None and conversion not in ("r", "s", "a"):
+            return None
+        if spec and any(char in spec for char in "{}'\"\\\n\r\0"):
+            return None
+        conversion = f"!{conversion}" if conversion else ""
+        spec = f":{spec}" if spec else ""
+        parts.append(f"f'{{{field}{conversion}{spec}}}'")
+    return " ".join(parts) or "''"
+
+
+def _bind_template(name, handler, format_string, fields, sig):
+    # Fallback for fields that cannot be used as argument names of generated code.
+    # The field list is known up front, so bind arguments by hand rather than
+    # paying for sig.bind() on every call.
+    def func(*args, **kwargs):
+        if len(args) > len(fields):
+            raise TypeError(
+                f"{name}() takes {len(fields)} positional arguments but {len(args)} were given"
+            )
+        for field, value in zip(fields, args):
+            if field in kwargs:
+                raise TypeError(f"{name}() got multiple values for argument '{field}'")
+            kwargs[field] = value
+        if len(kwargs) != len(fields):
+            missing = [field for field in fields if field not in kwargs]
+            if missing:
+                raise TypeError(f"{name}() missing required arguments: {missing}")
+            unexpected = [key for key in kwargs if key not in sig.parameters]
+            raise TypeError(f"{name}() got unexpected keyword arguments: {unexpected}")
+        return handler(format_string.format_map(kwargs))
+
     return func
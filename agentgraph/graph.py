@@ -1,10 +1,250 @@
+import asyncio
 import collections
-from concurrent.futures import ThreadPoolExecutor, as_completed, Future
-from .node import Node, InputNode, AggregateNode
+import inspect
+import keyword
+import operator
+import queue
+import sys
+import threading
+import types
+from concurrent.futures import Future, ThreadPoolExecutor
+from .node import Node, InputNode, _error_repr, _func_name, _required_params
 from .function import template_function, template_function_with_handler
 
 Edge = collections.namedtuple("Edge", ["from_node", "to_node", "arg_name"])
 
+# Everything the DAG needs to execute, derived from the graph structure.
+#   order: all nodes in topological order
+#   steps: (node, invoke, gather) for each non-input node in topological order
+#   invokers: {node_name: callable that runs the node}
+#   gatherers: {node_name: callable mapping node outputs to the node's kwargs}
+#   run: generated function executing every step in order, see _compile_steps
+#   index: {node_name: position of the node in order}
+#   dependencies: number of incoming edges of each node, by position in order
+#   children: (to_node position, ...) for each node, by position in order
+#   parents: (from_node position, ...) for each node, by position in order
+#   priority: length of the longest path from each node to a sink, by position in order
+#   release: for each step, the nodes whose output is last read by that step
+#   serial: True when no two non-input nodes can ever run at the same time
+#   source_nodes / input_nodes: frozensets used to validate input values
+#   coroutines: frozenset of nodes whose function is a coroutine function
+#   pruned: {frozenset of output names: which nodes they depend on}, filled on demand
+_Plan = collections.namedtuple(
+    "_Plan",
+    [
+        "order",
+        "steps",
+        "invokers",
+        "gatherers",
+        "run",
+        "index",
+        "dependencies",
+        "children",
+        "parents",
+        "priority",
+        "release",
+        "serial",
+        "source_nodes",
+        "input_nodes",
+        "coroutines",
+        "pruned",
+    ],
+)
+
+
+class _IdentityKey:
+    """Cache key for unhashable values.  Compares by identity and keeps the value alive
+    so that its id cannot be reused by another object while the key exists."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, _IdentityKey) and self.value is other.value
+
+    def __hash__(self):
+        return id(self.value)
+
+
+def _fingerprint(value):
+    # aggregate inputs arrive as dicts, so fingerprint their contents rather than
+    # the freshly built dict itself.
+    if isinstance(value, dict):
+        return tuple((key, _fingerprint(item)) for key, item in value.items())
+    try:
+        hash(value)
+    except TypeError:
+        return _IdentityKey(value)
+    # include the type so that equal values of different types, such as 1 and True,
+    # do not share a cache entry.
+    return (type(value), value)
+
+
+def _make_gatherer(node, arguments):
+    # Build the function that resolves a node's keyword arguments from the outputs of
+    # its parents.  arguments is ((arg_name, from_node or tuple of from_nodes), ...).
+    # The shape of each node's inputs is fixed once the plan is built, so the common
+    # cases get a specialised function instead of a generic loop per execution.
+    if node.is_aggregate and node.values_only:
+
+        def gather(node_outputs):
+            get = node_outputs.__getitem__
+            return {arg_name: list(map(get, sources)) for arg_name, sources in arguments}
+
+    elif node.is_aggregate:
+
+        def gather(node_outputs):
+            get = node_outputs.__getitem__
+            return {
+                arg_name: dict(zip(sources, map(get, sources)))
+                for arg_name, sources in arguments
+            }
+
+    elif not arguments:
+
+        def gather(node_outputs):
+            return {}
+
+    elif len(arguments) == 1:
+        ((arg_name, source),) = arguments
+
+        def gather(node_outputs):
+            return {arg_name: node_outputs[source]}
+
+    else:
+        arg_names = tuple(arg_name for arg_name, _ in arguments)
+        get = operator.itemgetter(*(source for _, source in arguments))
+
+        def gather(node_outputs):
+            return dict(zip(arg_names, get(node_outputs)))
+
+    return gather
+
+
+def _call_error(node_name, func_name, inputs):
+    # only called once an error has happened, so successful calls never pay for it
+    return TypeError(
+        f"{node_name} got error calling {func_name} "
+        f"with kwargs {_error_repr.repr(inputs)}"
+    )
+
+
+def _run_node(node_name, func_name, invoke, inputs):
+    # The unit of work sent to an executor.  It is a module level function and only
+    # carries the node's name, callable and inputs, so process based executors can
+    # pickle it.  The Node itself may hold unpicklable attributes such as cache_key.
+    try:
+        output = invoke(**inputs)
+    except TypeError as e:
+        raise _call_error(node_name, func_name, inputs) from e
+    return (node_name, output)
+
+
+def _positional(invoke, arg_names):
+    """Returns arg_names in parameter order if invoke can be called positionally."""
+    if type(invoke) is not types.FunctionType:
+        return None
+    code = invoke.__code__
+    params = code.co_varnames[: len(arg_names)]
+    if (
+        code.co_posonlyargcount
+        or len(arg_names) > code.co_argcount
+        or set(params) != set(arg_names)
+    ):
+        return None
+    return params
+
+
+def _compile_steps(steps, arguments):
+    # Generates a function that runs the steps in order, e.g.
+    #     def execute(o, _execute_node):
+    #         v0 = o[_k0]
+    #         v1 = _i1(v0)
+    #         o[_k1] = v1
+    #         return o
+    # so that sequential execution is straight-line code with outputs held in local
+    # variables.  Node names and callables are passed in through the globals, so any
+    # hashable name works.  Plain functions whose arguments are their leading
+    # parameters are called positionally, cacheable nodes go through _execute_node,
+    # and nodes whose argument names are not identifiers are called with a ** dict.
+    namespace = {"_call_error": _call_error}
+    numbers = {}
+    lines = ["def execute(o, _execute_node):"]
+
+    def number(node_name):
+        if node_name not in numbers:
+            # anything not produced by an earlier step is an input value
+            numbers[node_name] = len(numbers)
+            namespace[f"_k{numbers[node_name]}"] = node_name
+            lines.append(f"    v{numbers[node_name]} = o[_k{numbers[node_name]}]")
+        return numbers[node_name]
+
+    def inputs(node, args):
+        items = []
+        for arg_name, source in args:
+            if node.is_aggregate and node.values_only:
+                value = ", ".join(f"v{number(s)}" for s in source)
+                value = f"[{value}]"
+            elif node.is_aggregate:
+                value = ", ".join(f"_k{number(s)}: v{number(s)}" for s in source)
+                value = f"{{{value}}}"
+            else:
+                value = f"v{number(source)}"
+            items.append(f"{arg_name!r}: {value}")
+        return f"{{{', '.join(items)}}}"
+
+    for node, invoke, _ in steps:
+        args = arguments[node.name]
+        kwargs = inputs(node, args)
+        n = numbers[node.name] = len(numbers)
+        namespace[f"_k{n}"] = node.name
+        namespace[f"_n{n}"] = node
+        namespace[f"_i{n}"] = invoke
+        namespace[f"_f{n}"] = _func_name(node.func)
+        if node.cacheable:
+            lines.append(f"    v{n} = _execute_node(_n{n}, _i{n}, {kwargs})[1]")
+            continue
+        sources = dict(args)
+        positional = None if node.is_aggregate else _positional(invoke, sources)
+        if positional is not None:
+            call = ", ".join(f"v{numbers[sources[name]]}" for name in positional)
+        elif not node.is_aggregate and all(
+            arg_name.isidentifier() and not keyword.iskeyword(arg_name)
+            for arg_name, _ in args
+        ):
+            call = ", ".join(
+                f"{arg_name}=v{numbers[source]}" for arg_name, source in args
+            )
+        else:
+            call = f"**{kwargs}"
+        lines.append("    try:")
+        lines.append(f"        v{n} = _i{n}({call})")
+        lines.append("    except TypeError as e:")
+        lines.append(f"        raise _call_error(_k{n}, _f{n}, {kwargs}) from e")
+    for node, _, _ in steps:
+        lines.append(f"    o[_k{numbers[node.name]}] = v{numbers[node.name]}")
+    lines.append("    return o")
+
+    exec("\n".join(lines) + "\n", namespace)
+    return namespace["execute"]
+
+
+# Set on the threads of the shared pool and of the private pools used for nested
+# executions, see DAG._get_executor().
+_pool_thread = threading.local()
+
+
+def _mark_pool_thread():
+    _pool_thread.active = True
+
+
+# Nodes are mostly I/O bound (LLM and HTTP calls) and the shared pool serves every
+# concurrent caller in the process, so it is sized for waiting rather than for the
+# number of CPUs.  Threads are only started when no idle thread is available.
+_SHARED_POOL_WORKERS = 256
+
 
 class DAG:
     """DAG is the core class that represents a computation graph.
@@ -14,191 +254,790 @@ class DAG:
     dictionary that is used to populate the values for any InputNode's in the graph. The
     output of the graph is a dictionary returned by the execute() method which contains the
     output of each node in the graph, keyed by the node name.
+
+    Before the first execution the DAG compiles an execution plan (topological order,
+    dependency counts and per-node inputs) which is reused until the graph changes.
+    prepare() builds the plan up front and freezes the graph against further changes.
+
+    execute_parallel() and execute_batch() run nodes on a thread pool that is shared by
+    every DAG and created on first use, so repeated executions do not pay for starting
+    and stopping threads.  shutdown_executor() stops it; a new pool is created the next
+    time one is needed.  A node that itself executes a graph in parallel gets a private
+    pool for that execution, since waiting on the shared pool from one of its own
+    threads could deadlock once every thread is waiting.
     """
 
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    @classmethod
+    def _get_executor(cls):
+        with cls._executor_lock:
+            if DAG._executor is None:
+                DAG._executor = ThreadPoolExecutor(
+                    max_workers=_SHARED_POOL_WORKERS,
+                    thread_name_prefix="agentgraph",
+                    initializer=_mark_pool_thread,
+                )
+            return DAG._executor
+
+    @classmethod
+    def shutdown_executor(cls, wait=True):
+        """Shut down the thread pool used by execute_parallel() and execute_batch().
+
+        Only call this once no execution is using the shared pool, for example at
+        application exit.  An execution that is still running when the pool shuts down
+        fails with RuntimeError when it next schedules a node.
+        """
+        with cls._executor_lock:
+            executor, DAG._executor = DAG._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
     def __init__(self):
         self.nodes = {}
         self.edges = []
         # inverse list of edges for cycle detection and dependency counting
         # {to_node: [from_node, from_node, ...]}
-        self.inverse_edges = collections.defaultdict(list)
+        self.inverse_edges = {}
+        # {from_node: [to_node, to_node, ...]}
+        self.forward_edges = {}
+        # (from_node, to_node) pairs for constant time duplicate edge checks
+        self._edge_pairs = set()
+        # input plan for each node, {to_node: {arg_name: [from_node, ...]}}
+        self._input_plans = {}
+        # topological rank of each node, maintained incrementally as edges are added
+        self._order = {}
+        # cached execution plan, reset whenever the graph changes
+        self._plan = None
+        self.prepared = False
+        # memoized outputs of cacheable nodes, kept in least recently used order and
+        # shared by executing threads.  {node_name: OrderedDict(input_key: output)}
+        self._cache = {}
+        self._cache_lock = threading.Lock()
 
     def add_node(self, node):
+        if self.prepared:
+            raise ValueError("Cannot add nodes after graph has been prepared!")
         if node.name in self.nodes:
             raise ValueError("Node with name {} already exists!".format(node.name))
+        if type(node.name) is str:
+            # node names are hashed and compared constantly by the scheduler; interned
+            # names let those lookups short-circuit on identity.
+            node.name = sys.intern(node.name)
         self.nodes[node.name] = node
+        self._order[node.name] = len(self._order)
+        self._plan = None
 
     def add_edge(self, from_node, to_node, arg_name):
+        if self.prepared:
+            raise ValueError("Cannot add edges after graph has been prepared!")
+        self._check_edge(from_node, to_node, arg_name, self._edge_pairs)
+
+        if self._order[from_node] >= self._order[to_node]:
+            self._reorder(from_node, to_node)
+
+        self._append_edge(from_node, to_node, arg_name)
+
+    def add_edges(self, edges):
+        """Add several (from_node, to_node, arg_name) edges at once.
+
+        Each edge is checked as in add_edge(), but the graph is checked for cycles once
+        for the whole batch rather than once per edge.  If any edge is invalid, or the
+        edges would create a cycle, none of them are added.
+        """
+        if self.prepared:
+            raise ValueError("Cannot add edges after graph has been prepared!")
+        edges = [Edge(*edge) for edge in edges]
+        pairs = set(self._edge_pairs)
+        added = {}
+        for from_node, to_node, arg_name in edges:
+            self._check_edge(from_node, to_node, arg_name, pairs)
+            pairs.add((from_node, to_node))
+            added.setdefault(from_node, []).append(to_node)
+
+        # Kahn's algorithm over the existing and new edges together.  The resulting
+        # order replaces the incremental ranks maintained by add_edge().
+        indegree = {
+            node_name: len(self.inverse_edges.get(node_name, ()))
+            for node_name in self.nodes
+        }
+        for edge in edges:
+            indegree[edge.to_node] += 1
+        ready = [node_name for node_name, count in indegree.items() if count == 0]
+        order = []
+        while ready:
+            node_name = ready.pop()
+            order.append(node_name)
+            for children in (
+                self.forward_edges.get(node_name, ()),
+                added.get(node_name, ()),
+            ):
+                for child in children:
+                    indegree[child] -= 1
+                    if indegree[child] == 0:
+                        ready.append(child)
+
+        if len(order) < len(self.nodes):
+            for edge in edges:
+                if indegree[edge.to_node]:
+                    raise ValueError(f"Cycle in graph for {edge.to_node}")
+
+        self._order = {node_name: rank for rank, node_name in enumerate(order)}
+        for from_node, to_node, arg_name in edges:
+            self._append_edge(from_node, to_node, arg_name)
+
+    def _check_edge(self, from_node, to_node, arg_name, edge_pairs):
         if from_node not in self.nodes or to_node not in self.nodes:
             raise ValueError("Both nodes must exist within the graph!")
 
-        if any(
-            edge.from_node == from_node and edge.to_node == to_node
-            for edge in self.edges
-        ):
+        if (from_node, to_node) in edge_pairs:
             raise ValueError(f"Edge already exists from {from_node} to {to_node}!")
 
-        if arg_name not in self.nodes[to_node].signature.parameters:
+        if arg_name not in self.nodes[to_node].param_names:
             raise ValueError(
                 f"Argument {arg_name} not in function signature for {to_node}!"
             )
 
+    def _append_edge(self, from_node, to_node, arg_name):
         self.edges.append(Edge(from_node, to_node, arg_name))
-        self.inverse_edges[to_node].append(from_node)
-        self._cycle_check(to_node)
+        self._edge_pairs.add((from_node, to_node))
+        self.inverse_edges.setdefault(to_node, []).append(from_node)
+        self.forward_edges.setdefault(from_node, []).append(to_node)
+        self._input_plans.setdefault(to_node, {}).setdefault(arg_name, []).append(
+            from_node
+        )
+        self._plan = None
 
-    def _execute_node(self, node_name, node_outputs):
-        # Note: During parallel execution node_outputs is a copy and so should not be modified.
-        inputs = {}
+    def prepare(self):
+        """Build the execution plan and freeze the graph.
 
-        for edge in self.edges:
-            if edge.to_node is not node_name:
+        This is optional, the plan is otherwise built by the first execution.  After
+        prepare() no more nodes or edges can be added.
+        """
+        self._get_plan()
+        self.prepared = True
+
+    def _get_plan(self):
+        plan = self._plan
+        if plan is None:
+            plan = self._plan = self._build_plan()
+        return plan
+
+    def _build_plan(self):
+        order = self._topological_sort()
+
+        arguments = {}
+        gatherers = {}
+        for node in order:
+            if node.is_input:
                 continue
-            if isinstance(self.nodes[edge.to_node], AggregateNode):
-                if edge.arg_name not in inputs:
-                    inputs[edge.arg_name] = {}
-                inputs[edge.arg_name][edge.from_node] = node_outputs[edge.from_node]
+            plan = self._input_plans.get(node.name, {})
+            if node.is_aggregate:
+                arguments[node.name] = tuple(
+                    (arg_name, tuple(sources)) for arg_name, sources in plan.items()
+                )
             else:
-                inputs[edge.arg_name] = node_outputs[edge.from_node]
-        return (node_name, self.nodes[node_name].execute(**inputs))
+                # a later edge to the same argument replaces an earlier one
+                arguments[node.name] = tuple(
+                    (arg_name, sources[-1]) for arg_name, sources in plan.items()
+                )
+                # report a missing edge before anything runs rather than from the call.
+                # Nodes without any incoming edge are reported as such when the input
+                # values are validated.
+                missing = []
+                if plan:
+                    missing = [
+                        arg_name
+                        for arg_name in _required_params(node.func)
+                        if arg_name not in plan
+                    ]
+                if missing:
+                    raise TypeError(
+                        f"{node.name} is missing required arguments: "
+                        f"{', '.join(map(str, missing))}"
+                    )
+            gatherers[node.name] = _make_gatherer(node, arguments[node.name])
 
-    def execute(self, input_values):
+        invokers = {node.name: node.invoker() for node in order if not node.is_input}
+        steps = tuple(
+            (node, invokers[node.name], gatherers[node.name])
+            for node in order
+            if not node.is_input
+        )
+
+        # the step after which each node's output is no longer needed
+        last_use = {}
+        for index, (node, _, _) in enumerate(steps):
+            last_use[node.name] = index
+            for parent in self.inverse_edges.get(node.name, ()):
+                last_use[parent] = index
+        release = [[] for _ in steps]
+        for node_name, index in last_use.items():
+            release[index].append(node_name)
+
+        # the schedulers track nodes by position so that the per-edge bookkeeping is
+        # list indexing rather than dict lookups.
+        index = {node.name: position for position, node in enumerate(order)}
+        children = tuple(
+            tuple(index[child] for child in self.forward_edges.get(node.name, ()))
+            for node in order
+        )
+        priority = [1] * len(order)
+        for position in reversed(range(len(order))):
+            for child in children[position]:
+                if priority[child] >= priority[position]:
+                    priority[position] = priority[child] + 1
+
+        return _Plan(
+            order=tuple(order),
+            steps=steps,
+            invokers=invokers,
+            gatherers=gatherers,
+            run=_compile_steps(steps, arguments),
+            index=index,
+            dependencies=tuple(
+                len(self.inverse_edges.get(node.name, ())) for node in order
+            ),
+            children=children,
+            parents=tuple(
+                tuple(index[parent] for parent in self.inverse_edges.get(node.name, ()))
+                for node in order
+            ),
+            priority=tuple(priority),
+            release=tuple(tuple(node_names) for node_names in release),
+            # the steps form a single chain when each one consumes the previous one
+            serial=all(
+                previous.name in self.inverse_edges.get(node.name, ())
+                for (previous, _, _), (node, _, _) in zip(steps, steps[1:])
+            ),
+            # nodes without incoming edges, which must all be InputNodes with a value
+            source_nodes=frozenset(
+                node_name for node_name in self.nodes if node_name not in self.inverse_edges
+            ),
+            input_nodes=frozenset(
+                node_name for node_name, node in self.nodes.items() if node.is_input
+            ),
+            coroutines=frozenset(
+                node.name
+                for node, _, _ in steps
+                if inspect.iscoroutinefunction(node.func)
+            ),
+            pruned={},
+        )
+
+    def _cache_key(self, node, inputs):
+        if node.cache_key is not None:
+            return node.cache_key(**inputs)
+        if node.is_aggregate and node.values_only:
+            # the gatherer builds a fresh list per execution, so key on its contents.
+            # Lists passed in by the caller are still compared by identity below,
+            # since they may be mutated in place between executions.
+            return tuple(
+                (arg_name, tuple(map(_fingerprint, values)))
+                for arg_name, values in sorted(inputs.items())
+            )
+        return tuple(
+            (arg_name, _fingerprint(value))
+            for arg_name, value in sorted(inputs.items())
+        )
+
+    def _cache_get(self, node, key):
+        # returns a one-tuple holding the cached output, or None on a miss
+        with self._cache_lock:
+            entries = self._cache.get(node.name)
+            if entries is not None and key in entries:
+                entries.move_to_end(key)
+                return (entries[key],)
+        return None
+
+    def _cache_put(self, node, key, output):
+        if node.cache_size == 0:
+            return
+        with self._cache_lock:
+            entries = self._cache.setdefault(node.name, collections.OrderedDict())
+            entries[key] = output
+            if node.cache_size is not None and len(entries) > node.cache_size:
+                entries.popitem(last=False)
+
+    def _execute_node(self, node, invoke, inputs):
+        if node.cacheable:
+            key = self._cache_key(node, inputs)
+            cached = self._cache_get(node, key)
+            if cached is not None:
+                return (node.name, cached[0])
+
+        result = _run_node(node.name, _func_name(node.func), invoke, inputs)
+        if node.cacheable:
+            self._cache_put(node, key, result[1])
+        return result
+
+    def _submit(self, executor, node, invoke, inputs):
+        # Run a node on executor and return a future for its (node_name, output).
+        # Cache lookups happen here on the scheduling thread; a hit returns an already
+        # completed future without involving the executor.
+        if not node.cacheable:
+            return executor.submit(
+                _run_node, node.name, _func_name(node.func), invoke, inputs
+            )
+
+        key = self._cache_key(node, inputs)
+        cached = self._cache_get(node, key)
+        if cached is not None:
+            future = Future()
+            future.set_result((node.name, cached[0]))
+            return future
+
+        def store(future):
+            if future.exception() is None:
+                self._cache_put(node, key, future.result()[1])
+
+        future = executor.submit(
+            _run_node, node.name, _func_name(node.func), invoke, inputs
+        )
+        future.add_done_callback(store)
+        return future
+
+    async def _execute_node_async(self, node, invoke, inputs):
+        # same as _execute_node, for nodes whose function is a coroutine function
+        if node.cacheable:
+            key = self._cache_key(node, inputs)
+            cached = self._cache_get(node, key)
+            if cached is not None:
+                return (node.name, cached[0])
+
+        try:
+            output = await invoke(**inputs)
+        except TypeError as e:
+            raise _call_error(node.name, _func_name(node.func), inputs) from e
+
+        if node.cacheable:
+            self._cache_put(node, key, output)
+        return (node.name, output)
+
+    def invalidate(self, node_name=None):
+        """Discard memoized outputs for node_name, or for every node if no name is given."""
+        with self._cache_lock:
+            if node_name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(node_name, None)
+
+    def invalidate_source(self, node_name):
+        """Discard memoized outputs for node_name and every node downstream of it.
+
+        Use this when something a node depends on has changed outside of the graph,
+        such as a document store read by a retrieval node.
+        """
+        stack = [node_name]
+        visited = {node_name}
+        with self._cache_lock:
+            while stack:
+                current = stack.pop()
+                self._cache.pop(current, None)
+                for child in self.forward_edges.get(current, ()):
+                    if child not in visited:
+                        visited.add(child)
+                        stack.append(child)
+
+    def execute(self, input_values, outputs=None):
         """Execute the graph.
 
         Args:
             input_values: A dictionary of input values for the graph.  The keys are the
                 node names, and the values are the input values for the nodes.  Provide
                 an empty dictionary if there are no input values.
+            outputs: Optional collection of node names to return.  When given, only
+                these nodes and the nodes they depend on are run, and every other
+                node's output is released as soon as its last consumer has run, which
+                bounds memory use for graphs with large intermediate values.
         """
-        self._validate_input_values(input_values)
+        plan = self._get_plan()
+        self._validate_input_values(plan, input_values)
+        keep = self._validate_outputs(outputs)
 
         # Compute the values from inputs to outputs.
+        node_outputs = dict(input_values)
+        if keep is None:
+            return plan.run(node_outputs, self._execute_node)
+
+        # Run the needed non-input nodes in topological order, releasing outputs as
+        # we go.  Skipped nodes never produce an output, hence pop() below.
+        needed = self._needed(plan, keep)
+        for index, (node, invoke, gather) in enumerate(plan.steps):
+            if needed[plan.index[node.name]]:
+                inputs = gather(node_outputs)
+                _, node_outputs[node.name] = self._execute_node(node, invoke, inputs)
+            for node_name in plan.release[index]:
+                if node_name not in keep:
+                    node_outputs.pop(node_name, None)
+
+        return {node_name: node_outputs[node_name] for node_name in outputs}
+
+    def execute_parallel(self, input_values=None, outputs=None, executor=None):
+        """Execute the graph, running independent nodes concurrently in a thread pool.
+
+        Graphs whose nodes form a single chain have nothing to run concurrently, so
+        unless an executor is given they are run on the calling thread by execute().
+
+        Takes the same arguments as execute(), plus:
+            executor: Optional concurrent.futures.Executor to run the nodes on instead
+                of the shared thread pool.  It is not shut down afterwards.  With a
+                ProcessPoolExecutor, node functions, their inputs and their outputs
+                must be picklable.
+        """
+        plan = self._get_plan()
+        if plan.serial and executor is None:
+            # nothing can run concurrently, so skip the thread pool altogether
+            return self.execute(input_values, outputs)
+        if executor is None and getattr(_pool_thread, "active", False):
+            with ThreadPoolExecutor(initializer=_mark_pool_thread) as executor:
+                return self.execute_parallel(input_values, outputs, executor)
+        self._validate_input_values(plan, input_values)
+        keep = self._validate_outputs(outputs)
+
         node_outputs = {}
-        for node_name, value in input_values.items():
-            node_outputs[node_name] = value
-
-        # Run all nodes in post order
-        post_order = self._topological_sort(self.nodes)
-        for node in post_order:
-            if isinstance(node, InputNode):
-                pass
+        # Completed futures are pushed here by their done callbacks, so the loop below
+        # only ever waits on a single queue no matter how many tasks are in flight.
+        completed = queue.SimpleQueue()
+        # (node_name, output) pairs produced on this thread: input values and the
+        # results of inline nodes.  These are recorded before waiting on the queue.
+        finished = collections.deque()
+
+        if executor is None:
+            executor = self._get_executor()
+        order = plan.order
+        # Number of unexecuted nodes that each node depends on, by position in order.
+        dependencies = list(plan.dependencies)
+        # Whether each node is needed for the requested outputs, by position in order.
+        needed = None
+        # Number of unscheduled consumers of each node's output, by position in order.
+        consumers = None
+        if keep is not None:
+            needed = self._needed(plan, keep)
+            consumers = [
+                sum(map(needed.__getitem__, children)) for children in plan.children
+            ]
+
+        def release(positions):
+            for position in positions:
+                consumers[position] -= 1
+                if consumers[position] == 0 and order[position].name not in keep:
+                    del node_outputs[order[position].name]
+
+        def schedule(positions):
+            # submit pooled nodes first so their work starts before we spend time
+            # running inline nodes on this thread.  Inputs are gathered here on the
+            # scheduling thread, so workers never read node_outputs.  Nodes on the
+            # longest remaining path go first, since they bound the total run time.
+            if len(positions) > 1:
+                positions.sort(key=plan.priority.__getitem__, reverse=True)
+            inline = []
+            for position in positions:
+                node = order[position]
+                if node.inline:
+                    inline.append(position)
+                else:
+                    inputs = plan.gatherers[node.name](node_outputs)
+                    future = self._submit(
+                        executor, node, plan.invokers[node.name], inputs
+                    )
+                    future.add_done_callback(completed.put)
+                    if consumers is not None:
+                        release(plan.parents[position])
+            for position in inline:
+                node = order[position]
+                inputs = plan.gatherers[node.name](node_outputs)
+                if consumers is not None:
+                    release(plan.parents[position])
+                finished.append(
+                    self._execute_node(node, plan.invokers[node.name], inputs)
+                )
+
+        # Run all nodes with zero dependencies.
+        ready = []
+        for position, count in enumerate(dependencies):
+            if count > 0 or (needed is not None and not needed[position]):
+                continue
+
+            node = order[position]
+            if node.is_input:
+                finished.append((node.name, input_values[node.name]))
             else:
-                _, output = self._execute_node(node.name, node_outputs)
-                node_outputs[node.name] = output
+                ready.append(position)
+        schedule(ready)
 
+        # Every needed node completes exactly once.  As each one finishes we decrement
+        # the dependency counts of its children and schedule any that are ready to run.
+        for _ in range(len(plan.order) if needed is None else sum(needed)):
+            if finished:
+                node_name, result = finished.popleft()
+            else:
+                node_name, result = completed.get().result()
+            position = plan.index[node_name]
+            if consumers is None or consumers[position] or node_name in keep:
+                node_outputs[node_name] = result
+
+            ready = []
+            for child in plan.children[position]:
+                dependencies[child] -= 1
+
+                # is the node ready to run?
+                if dependencies[child] == 0 and (needed is None or needed[child]):
+                    ready.append(child)
+            schedule(ready)
+
+        if keep is not None:
+            return {node_name: node_outputs[node_name] for node_name in outputs}
         return node_outputs
 
-    def execute_parallel(self, input_values=None):
-        self._validate_input_values(input_values)
+    async def execute_async(self, input_values=None, outputs=None, executor=None):
+        """Execute the graph on the running event loop.
+
+        Nodes whose function is a coroutine function are awaited as tasks on the loop,
+        so many concurrent I/O bound nodes need no threads.  Inline nodes run directly
+        on the loop, and other nodes run in the shared thread pool.
 
+        Takes the same arguments as execute_parallel().
+        """
+        if executor is None and getattr(_pool_thread, "active", False):
+            with ThreadPoolExecutor(initializer=_mark_pool_thread) as executor:
+                return await self.execute_async(input_values, outputs, executor)
+        plan = self._get_plan()
+        self._validate_input_values(plan, input_values)
+        keep = self._validate_outputs(outputs)
+
+        loop = asyncio.get_running_loop()
+        if executor is None:
+            executor = self._get_executor()
         node_outputs = {}
-        with ThreadPoolExecutor() as executor:
-            # We use the futures to track which nodes have just completed execution,
-            # and then we decrement the dependency count for each of their children.
-            futures = {}
-
-            # Number of unexecuted nodes that each node depends on.
-            dependencies = {
-                node_name: len(self.inverse_edges[node_name])
-                for node_name in self.nodes
-            }
+        # Completed tasks and executor futures are pushed here by their done callbacks.
+        completed = asyncio.Queue()
+        # (node_name, output) pairs produced on the loop without awaiting.
+        finished = collections.deque()
 
-            # Run all nodes with zero dependencies, and populate the futures list
-            # with initial values.
-            for node_name, count in dependencies.items():
-                if count > 0:
-                    continue
+        order = plan.order
+        # Number of unexecuted nodes that each node depends on, by position in order.
+        dependencies = list(plan.dependencies)
+        # Whether each node is needed for the requested outputs, by position in order.
+        needed = None
+        # Number of unscheduled consumers of each node's output, by position in order.
+        consumers = None
+        if keep is not None:
+            needed = self._needed(plan, keep)
+            consumers = [
+                sum(map(needed.__getitem__, children)) for children in plan.children
+            ]
+
+        def release(positions):
+            for position in positions:
+                consumers[position] -= 1
+                if consumers[position] == 0 and order[position].name not in keep:
+                    del node_outputs[order[position].name]
 
-                if isinstance(self.nodes[node_name], InputNode):
-                    input_future = Future()
-                    input_future.set_result((node_name, input_values[node_name]))
-                    futures[node_name] = input_future
+        def schedule(positions):
+            if len(positions) > 1:
+                positions.sort(key=plan.priority.__getitem__, reverse=True)
+            inline = []
+            for position in positions:
+                node = order[position]
+                node_name = node.name
+                if node.inline and node_name not in plan.coroutines:
+                    inline.append(position)
+                    continue
+                invoke = plan.invokers[node_name]
+                inputs = plan.gatherers[node_name](node_outputs)
+                if node_name in plan.coroutines:
+                    future = loop.create_task(
+                        self._execute_node_async(node, invoke, inputs)
+                    )
                 else:
-                    futures[node_name] = executor.submit(
-                        self._execute_node, node_name, node_outputs
+                    future = asyncio.wrap_future(
+                        self._submit(executor, node, invoke, inputs), loop=loop
                     )
+                future.add_done_callback(completed.put_nowait)
+                if consumers is not None:
+                    release(plan.parents[position])
+            for position in inline:
+                node = order[position]
+                inputs = plan.gatherers[node.name](node_outputs)
+                if consumers is not None:
+                    release(plan.parents[position])
+                finished.append(
+                    self._execute_node(node, plan.invokers[node.name], inputs)
+                )
+
+        # Run all nodes with zero dependencies.
+        ready = []
+        for position, count in enumerate(dependencies):
+            if count > 0 or (needed is not None and not needed[position]):
+                continue
+
+            node = order[position]
+            if node.is_input:
+                finished.append((node.name, input_values[node.name]))
+            else:
+                ready.append(position)
+        schedule(ready)
+
+        for _ in range(len(plan.order) if needed is None else sum(needed)):
+            if finished:
+                node_name, result = finished.popleft()
+            else:
+                node_name, result = (await completed.get()).result()
+            position = plan.index[node_name]
+            if consumers is None or consumers[position] or node_name in keep:
+                node_outputs[node_name] = result
 
-            # loop over futures until list it is empty.
-            # futures will always have at least one element until all work is done.
-            # this is because as soon as a future completes, we decrement the dependency
-            # counts and enqueue futures for any new nodes that are ready to run.
-            while futures:
-                for future in as_completed(futures.values()):
-                    # record results
-                    node_name, result = future.result()
-                    node_outputs[node_name] = result
-
-                    # update dependency counts and enqueue new futures
-                    for _, dependent_node_name, _ in [
-                        edge for edge in self.edges if edge.from_node == node_name
-                    ]:
-                        dependencies[dependent_node_name] -= 1
-
-                        # is the node ready to run?
-                        if dependencies[dependent_node_name] == 0:
-                            futures[dependent_node_name] = executor.submit(
-                                self._execute_node,
-                                dependent_node_name,
-                                node_outputs,
-                            )
-
-                    # remove this node from the futures list
-                    del futures[node_name]
+            ready = []
+            for child in plan.children[position]:
+                dependencies[child] -= 1
+                if dependencies[child] == 0 and (needed is None or needed[child]):
+                    ready.append(child)
+            schedule(ready)
+
+        if keep is not None:
+            return {node_name: node_outputs[node_name] for node_name in outputs}
         return node_outputs
 
-    def _cycle_check(self, node_name):
-        # Perform cycle check
-        visited = set()
+    def execute_batch(self, rows, executor=None):
+        """Execute the graph once for each dictionary of input values in rows.
 
-        def dfs(node_name):
-            if node_name in visited:
-                return True
-            visited.add(node_name)
-            return any(
-                dfs(edge.to_node) for edge in self.edges if edge.from_node == node_name
-            )
+        The graph is evaluated a node at a time rather than a row at a time: each node
+        runs for every row before the next node starts, so scheduling work is paid once
+        per node instead of once per row.  Inline nodes run in a loop on the calling
+        thread and all other nodes run across the rows in a thread pool.
+
+        executor optionally replaces the shared thread pool, as in execute_parallel().
+
+        Returns a list with the output dictionary of each row, in the same order as rows.
+        """
+        if executor is None and getattr(_pool_thread, "active", False):
+            with ThreadPoolExecutor(initializer=_mark_pool_thread) as executor:
+                return self.execute_batch(rows, executor)
+        plan = self._get_plan()
+        for input_values in rows:
+            self._validate_input_values(plan, input_values)
+
+        outputs = [dict(input_values) for input_values in rows]
+        if executor is None:
+            executor = self._get_executor()
+        for node, invoke, gather in plan.steps:
+            inputs = [gather(row) for row in outputs]
+            if node.inline:
+                results = [self._execute_node(node, invoke, args) for args in inputs]
+            else:
+                futures = [
+                    self._submit(executor, node, invoke, args) for args in inputs
+                ]
+                results = [future.result() for future in futures]
+            for row, (_, result) in zip(outputs, results):
+                row[node.name] = result
+        return outputs
 
-        if dfs(node_name):
-            raise ValueError(f"Cycle in graph for {node_name}")
-
-    def _topological_sort(self, nodes):
-        # determine the order in which to execute the nodes
-        visited = set()
-        post_order = []
-
-        def dfs(node_name):
-            visited.add(node_name)
-            for edge in self.edges:
-                if edge.from_node == node_name and edge.to_node not in visited:
-                    dfs(edge.to_node)
-            post_order.append(self.nodes[node_name])
-
-        for node_name in nodes:
-            if node_name not in visited:
-                dfs(node_name)
-
-        post_order = list(reversed(post_order))
-        return post_order
-
-    def _validate_input_values(self, input_values):
-        for node_name in input_values:
-            if node_name not in self.nodes:
-                raise ValueError(f"Input value provided for unknown node {node_name}")
-
-        # validate that input is provided for all nodes without input edges
-        for node_name in self.nodes:
-            if node_name in input_values:
-                if not isinstance(self.nodes[node_name], InputNode):
+    def _reorder(self, from_node, to_node):
+        # Pearce-Kelly online topological ordering.  The new edge violates the
+        # current order, so only nodes ranked between to_node and from_node can
+        # be affected.  Collect the ones reachable from to_node and the ones that
+        # reach from_node, then shuffle them within their existing ranks.
+        order = self._order
+        lower, upper = order[to_node], order[from_node]
+
+        forward = []
+        visited = {to_node}
+        stack = [to_node]
+        while stack:
+            node_name = stack.pop()
+            if node_name == from_node:
+                raise ValueError(f"Cycle in graph for {to_node}")
+            forward.append(node_name)
+            for child in self.forward_edges.get(node_name, ()):
+                if child not in visited and order[child] <= upper:
+                    visited.add(child)
+                    stack.append(child)
+
+        backward = []
+        visited = {from_node}
+        stack = [from_node]
+        while stack:
+            node_name = stack.pop()
+            backward.append(node_name)
+            for parent in self.inverse_edges.get(node_name, ()):
+                if parent not in visited and order[parent] > lower:
+                    visited.add(parent)
+                    stack.append(parent)
+
+        affected = sorted(backward, key=order.get) + sorted(forward, key=order.get)
+        ranks = sorted(order[node_name] for node_name in affected)
+        for node_name, rank in zip(affected, ranks):
+            order[node_name] = rank
+
+    def _topological_sort(self):
+        # determine the order in which to execute the nodes using Kahn's algorithm.
+        nodes = self.nodes
+        forward_edges = self.forward_edges
+        indegree = {
+            node_name: len(self.inverse_edges.get(node_name, ())) for node_name in nodes
+        }
+        ready = collections.deque(
+            node_name for node_name, count in indegree.items() if count == 0
+        )
+        order = []
+        while ready:
+            node_name = ready.popleft()
+            order.append(nodes[node_name])
+            for child in forward_edges.get(node_name, ()):
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    ready.append(child)
+
+        return order
+
+    def _needed(self, plan, keep):
+        """Returns whether each node, by position in plan.order, is an output in keep or
+        one of their ancestors."""
+        needed = plan.pruned.get(keep)
+        if needed is None:
+            needed = [False] * len(plan.order)
+            stack = [plan.index[node_name] for node_name in keep]
+            while stack:
+                position = stack.pop()
+                if not needed[position]:
+                    needed[position] = True
+                    stack.extend(plan.parents[position])
+            needed = plan.pruned[keep] = tuple(needed)
+        return needed
+
+    def _validate_outputs(self, outputs):
+        if outputs is None:
+            return None
+        keep = frozenset(outputs)
+        for node_name in keep - self.nodes.keys():
+            raise ValueError(f"Output requested for unknown node {node_name}")
+        return keep
+
+    def _validate_input_values(self, plan, input_values):
+        # The set operations below are the fast path.  Only when one of them finds a
+        # problem do we walk the nodes to report the first offender in graph order.
+        provided = input_values.keys()
+        for node_name in provided - self.nodes.keys():
+            raise ValueError(f"Input value provided for unknown node {node_name}")
+
+        invalid = provided - plan.input_nodes
+        if invalid:
+            for node_name in self.nodes:
+                if node_name in invalid:
                     raise ValueError(
                         f"Input value provided for non-input node {node_name}"
                     )
-                elif self.inverse_edges[node_name]:
-                    # this check might be redundant
-                    raise ValueError(
-                        f"Input value provided for node {node_name} with input edges"
-                    )
-            elif node_name not in self.inverse_edges:
-                if isinstance(self.nodes[node_name], InputNode):
+
+        # InputNodes have no parameters, so they can never have incoming edges.
+        missing = plan.source_nodes - provided
+        if missing:
+            for node_name in self.nodes:
+                if node_name not in missing:
+                    continue
+                if self.nodes[node_name].is_input:
                     raise ValueError(f"No input value provided for node {node_name}")
                 else:
                     raise ValueError(
@@ -237,16 +1076,18 @@ class SimpleGraph:
     def __init__(self):
         self.dag = DAG()
         self.prepared = False
+        self._inputs_added = False
 
-    def add_function(self, function):
+    def add_function(self, function, inline=False):
         if self.prepared:
             raise ValueError("Cannot add functions after graph has been prepared!")
-        node = Node(function.__name__, function)
+        node = Node(function.__name__, function, inline=inline)
         self.dag.add_node(node)
         return function
 
     def add_template_function(self, name, format_string):
-        return self.add_function(template_function(name, format_string))
+        # plain template expansion is too cheap to be worth a thread pool round trip
+        return self.add_function(template_function(name, format_string), inline=True)
 
     def add_template_function_with_handler(self, name, format_string, handler):
         return self.add_function(
@@ -258,25 +1099,47 @@ class SimpleGraph:
             self.add_function(function)
 
     def _create_edges(self):
-        for node in self.dag.nodes:
-            if isinstance(self.dag.nodes[node], InputNode):
-                continue
-            for arg in self.dag.nodes[node].signature.parameters:
-                if arg in self.dag.nodes:
-                    self.dag.add_edge(arg, node, arg)
+        nodes = self.dag.nodes
+        self.dag.add_edges(
+            (arg, node_name, arg)
+            for node_name, node in nodes.items()
+            if not node.is_input
+            for arg in node.param_names
+            if arg in nodes
+        )
 
     def _execute_prep(self, input_values=None):
         if not self.prepared:
-            for node_name in input_values.keys():
-                self.dag.add_node(InputNode(node_name))
+            if not self._inputs_added:
+                # check every name first so that a failure adds none of the InputNodes
+                for node_name in input_values.keys():
+                    if node_name in self.dag.nodes:
+                        raise ValueError(f"Node with name {node_name} already exists!")
+                for node_name in input_values.keys():
+                    self.dag.add_node(InputNode(node_name))
+                self._inputs_added = True
 
+            # add_edges() either adds every edge or none, so it is safe to retry
             self._create_edges()
             self.prepared = True
+            # a graph error raised while building the plan is raised again by the
+            # execute call itself, as the graph is not frozen until it succeeds
+            self.dag.prepare()
+
+    def execute(self, input_values=None, outputs=None):
+        self._execute_prep(input_values)
+        return self.dag.execute(input_values, outputs)
 
-    def execute(self, input_values=None):
+    def execute_parallel(self, input_values=None, outputs=None, executor=None):
         self._execute_prep(input_values)
-        return self.dag.execute(input_values)
+        return self.dag.execute_parallel(input_values, outputs, executor)
 
-    def execute_parallel(self, input_values=None):
+    async def execute_async(self, input_values=None, outputs=None, executor=None):
         self._execute_prep(input_values)
-        return self.dag.execute_parallel(input_values)
+        return await self.dag.execute_async(input_values, outputs, executor)
+
+    def execute_batch(self, rows, executor=None):
+        if not rows:
+            return []
+        self._execute_prep(rows[0])
+        return self.dag.execute_batch(rows, executor)
@@ -12,7 +12,94 @@ Node names are used to identify nodes in the graph.  Node names must be unique w
 graph.
 """
 
+import functools
 import inspect
+import reprlib
+import types
+
+# Bounds the size of argument reprs in error messages, since node inputs are often
+# long prompts or LLM responses.
+_error_repr = reprlib.Repr()
+_error_repr.maxstring = 200
+_error_repr.maxother = 200
+
+
+def _func_name(func):
+    """Returns a name for func to use in error messages."""
+    # functools.partial objects, which the examples use as node functions, have no
+    # __name__
+    name = getattr(func, "__name__", None)
+    return name if name is not None else _error_repr.repr(func)
+
+
+def _param_names(func):
+    """Returns the parameter names of func, avoiding inspect.signature() where possible."""
+    signature = getattr(func, "__signature__", None)
+    if signature is not None:
+        return tuple(signature.parameters)
+    if (
+        type(func) is functools.partial
+        and type(func.func) is types.FunctionType
+        and not func.keywords
+        and len(func.args) <= func.func.__code__.co_argcount
+    ):
+        # the examples build nodes from partials, which bind leading arguments
+        return _param_names(func.func)[len(func.args) :]
+    if type(func) is not types.FunctionType or hasattr(func, "__wrapped__"):
+        return tuple(inspect.signature(func).parameters)
+
+    code = func.__code__
+    count = code.co_argcount + code.co_kwonlyargcount
+    if code.co_flags & inspect.CO_VARARGS:
+        count += 1
+    if code.co_flags & inspect.CO_VARKEYWORDS:
+        count += 1
+    return code.co_varnames[:count]
+
+
+def _required_params(func):
+    """Returns the names of the parameters of func that have no default value."""
+    if type(func) is types.FunctionType and not hasattr(func, "__wrapped__"):
+        if getattr(func, "__signature__", None) is None:
+            code = func.__code__
+            positional = code.co_varnames[: code.co_argcount]
+            required = positional[: len(positional) - len(func.__defaults__ or ())]
+            keyword_only = code.co_varnames[
+                code.co_argcount : code.co_argcount + code.co_kwonlyargcount
+            ]
+            defaults = func.__kwdefaults__ or {}
+            required += tuple(name for name in keyword_only if name not in defaults)
+            return required
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        # some builtins have no signature, let the call report any problem
+        return ()
+    return tuple(
+        parameter.name
+        for parameter in parameters
+        if parameter.default is parameter.empty
+        and parameter.kind not in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD)
+    )
+
+
+def _aggregate(func, aggregate_func, /, *args, **kwargs):
+    return func(aggregate_func(*args, **kwargs))
+
+
+_IDENTITY_CODE = (lambda x: x).__code__
+
+
+def _is_identity(func):
+    """Returns True if func is a plain one argument function that returns its argument."""
+    code = getattr(func, "__code__", None)
+    return (
+        type(func) is types.FunctionType
+        and code.co_code == _IDENTITY_CODE.co_code
+        and code.co_argcount == 1
+        and code.co_kwonlyargcount == 0
+        and not code.co_flags & (inspect.CO_VARARGS | inspect.CO_VARKEYWORDS)
+    )
 
 
 class Node:
@@ -30,19 +117,62 @@ class Node:
         dag.add_node(Node("static", static_fn))
         output = dag.execute()
         assert output["static"] == "Hello world!"
+
+    Nodes created with cacheable=True have their output memoized by the DAG.  If a
+    later execution passes the same inputs, the previous output is reused instead of
+    calling the function again.  Only use this for functions without side effects.
+    cache_size is the number of distinct inputs remembered per node, the least recently
+    used entry is evicted first.  Pass None to remember every input.  By default inputs
+    are compared by value when hashable and by identity otherwise; cache_key can be set
+    to a function that takes the node's inputs as keyword arguments and returns a
+    hashable key to compare them by instead.
+
+    Nodes created with inline=True are run directly on the scheduling thread by
+    DAG.execute_parallel() rather than being submitted to the thread pool.  This avoids
+    the thread handoff for cheap functions, but an inline node blocks scheduling while
+    it runs, so never use it for slow or I/O bound work.
     """
 
-    def __init__(self, name, func):
+    __slots__ = (
+        "name",
+        "func",
+        "param_names",
+        "cacheable",
+        "cache_size",
+        "cache_key",
+        "inline",
+    )
+
+    # Node kind flags, read by the DAG scheduler instead of isinstance() checks.
+    is_input = False
+    is_aggregate = False
+
+    def __init__(
+        self, name, func, cacheable=False, inline=False, cache_size=1, cache_key=None
+    ):
         self.name = name
         self.func = func
-        self.signature = inspect.signature(func)
+        self.param_names = _param_names(func)
+        self.cacheable = cacheable
+        self.cache_size = cache_size
+        self.cache_key = cache_key
+        self.inline = inline
+
+    @property
+    def signature(self):
+        return inspect.signature(self.func)
+
+    def invoker(self):
+        """Returns the callable the DAG calls with the node's inputs as keyword arguments."""
+        return self.func
 
     def execute(self, *argc, **kwargs):
         try:
             return self.func(*argc, **kwargs)
         except TypeError as e:
             raise TypeError(
-                f"{self.name} got error calling {self.func.__name__} with args {argc} and kwargs {kwargs}"
+                f"{self.name} got error calling {_func_name(self.func)} with args "
+                f"{_error_repr.repr(argc)} and kwargs {_error_repr.repr(kwargs)}"
             ) from e
 
 
@@ -62,8 +192,20 @@ class InputNode(Node):
         assert output["output"] == 4
     """
 
+    __slots__ = ()
+
+    is_input = True
+
     def __init__(self, name):
         self.name = name
+        self.param_names = ()
+        self.cacheable = False
+        self.cache_size = 0
+        self.cache_key = None
+        self.inline = False
+
+    def invoker(self):
+        raise NotImplementedError("InputNodes cannot be executed!")
 
     def execute(self):
         raise NotImplementedError("InputNodes cannot be executed!")
@@ -78,6 +220,10 @@ class AggregateNode(Node):
     There is a design limitation that needs to be fixed here, which is that the aggregate_func and the
     processing_func have to have the same signature.
 
+    Each argument of the aggregate_func receives a dictionary of the connected node outputs
+    keyed by node name.  With values_only=True it receives a list of the outputs instead,
+    in the order the edges were added, which avoids building a dictionary per execution.
+
     Example:
         def aggregate_fn(x):
             return sum(x)
@@ -98,9 +244,32 @@ class AggregateNode(Node):
         dag.execute({"input": 1, "input2": 2, "input3": 3})
         assert dag.nodes["aggregate"].output == 12"""
 
-    def __init__(self, name, func, aggregate_func):
-        super().__init__(name, func)
+    __slots__ = ("aggregate_func", "values_only")
+
+    is_aggregate = True
+
+    def __init__(
+        self,
+        name,
+        func,
+        aggregate_func,
+        cacheable=False,
+        inline=False,
+        cache_size=1,
+        cache_key=None,
+        values_only=False,
+    ):
+        super().__init__(name, func, cacheable, inline, cache_size, cache_key)
         self.aggregate_func = aggregate_func
+        self.values_only = values_only
+
+    def invoker(self):
+        # the examples pass lambda x: x as func, in which case the aggregate result is
+        # the output and the extra call can be skipped
+        if _is_identity(self.func):
+            return self.aggregate_func
+        # a partial of a module level function, unlike a closure, can be pickled
+        return functools.partial(_aggregate, self.func, self.aggregate_func)
 
     def execute(self, *argc, **kwargs):
         # TODO: there is a bug here.  the aggregate fn and the input fn have to have the same signature
@@ -103,3 +103,61 @@ def test_add_template_function_with_handler():
     )
     output = graph.execute({"input": "world", "input2": "again"})
     assert output["format"] == "HELLO WORLD AGAIN!"
+
+
+def test_template_function_bad_args():
+    template = "Hello {name}!"
+    func = template_function("some_name", template)
+    for args, kwargs in [
+        (("world", "again"), {}),
+        (("world",), {"name": "world"}),
+        ((), {"name": "world", "other": "again"}),
+    ]:
+        try:
+            func(*args, **kwargs)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("Expected TypeError")
+
+
+def test_template_function_shares_code():
+    from agentgraph.function import _compile_template
+
+    first = template_function("first", "Hello {name}!")
+    second = template_function("second", "Hello {name}!")
+    assert first.__code__ is second.__code__
+    assert first("world") == "Hello world!"
+    assert second.__name__ == "second"
+
+    # templates built on the fly must not grow the code cache without bound
+    for i in range(1000):
+        template_function("dynamic", f"Hello {{name}} {i}!")
+    assert _compile_template.cache_info().currsize <= 256
+
+
+def test_template_function_reserved_field():
+    func = template_function("some_name", "{_format} {_handler}")
+    assert func("Hello", "world") == "Hello world"
+
+
+def test_template_function_format_specs():
+    import datetime
+
+    for template in [
+        "{name!r:>10} {{literal}} 'single' \"double\" \\ {value:.2f}\n{name!a}",
+        "{day:%Y-%m-%d} {value:{width}}",
+        "{value:\0>8}",
+    ]:
+        func = template_function("some_name", template)
+        values = {"name": "wörld", "value": 3.14159, "day": datetime.date(2020, 1, 2)}
+        kwargs = {key: values[key] for key in func.__signature__.parameters}
+        try:
+            expected = template.format_map(kwargs)
+        except KeyError:
+            expected = KeyError
+        try:
+            result = func(**kwargs)
+        except KeyError:
+            result = KeyError
+        assert result == expected
@@ -450,3 +450,939 @@ def test_repeated_execution():
     assert output["upper"] == "HELLO"
     output = graph.execute_parallel({"input": "hello"})
     assert output["upper"] == "HELLO"
+
+
+def test_dag_cycle_detection_out_of_order():
+    dag = DAG()
+
+    for name in ["a", "b", "c", "d"]:
+        dag.add_node(Node(name, lambda x: x))
+
+    # edges are added against node insertion order, forcing re-ranking
+    dag.add_edge("c", "d", "x")
+    dag.add_edge("b", "c", "x")
+    dag.add_edge("a", "b", "x")
+    try:
+        dag.add_edge("d", "a", "x")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Should have raised a ValueError!")
+
+    try:
+        dag.add_edge("a", "a", "x")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Should have raised a ValueError!")
+
+    # the rejected edges must not be recorded
+    assert len(dag.edges) == 3
+
+
+def test_dag_diamond_is_not_a_cycle():
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    dag.add_node(Node("left", lambda x: x + 1))
+    dag.add_node(Node("right", lambda x: x + 2))
+    dag.add_node(Node("join", add))
+    dag.add_node(Node("start", lambda x: x))
+
+    dag.add_edge("left", "join", "x")
+    dag.add_edge("right", "join", "y")
+    dag.add_edge("start", "left", "x")
+    dag.add_edge("start", "right", "x")
+    dag.add_edge("input", "start", "x")
+
+    assert dag.execute({"input": 1})["join"] == 5
+    assert dag.execute_parallel({"input": 1})["join"] == 5
+
+
+def test_dag_deep_chain():
+    dag = DAG()
+    dag.add_node(InputNode("node0"))
+    for i in range(1, 2000):
+        dag.add_node(Node(f"node{i}", lambda x: x + 1))
+        dag.add_edge(f"node{i - 1}", f"node{i}", "x")
+
+    assert dag.execute({"node0": 0})["node1999"] == 1999
+    assert dag.execute({"node0": 1})["node1999"] == 2000
+
+
+def test_cacheable_node():
+    calls = []
+
+    def double(x):
+        calls.append(x)
+        return x * 2
+
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    dag.add_node(Node("double", double, cacheable=True))
+    dag.add_node(Node("plain", lambda x: x + 1))
+    dag.add_edge("input", "double", "x")
+    dag.add_edge("double", "plain", "x")
+
+    assert dag.execute({"input": 2})["plain"] == 5
+    assert dag.execute({"input": 2})["plain"] == 5
+    assert dag.execute_parallel({"input": 2})["plain"] == 5
+    assert calls == [2]
+
+    assert dag.execute({"input": 3})["plain"] == 7
+    assert calls == [2, 3]
+
+    dag.invalidate("double")
+    assert dag.execute({"input": 3})["plain"] == 7
+    assert calls == [2, 3, 3]
+
+
+def test_cacheable_node_unhashable_input():
+    calls = []
+
+    def total(x):
+        calls.append(x)
+        return sum(x)
+
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    dag.add_node(Node("total", total, cacheable=True))
+    dag.add_edge("input", "total", "x")
+
+    values = [1, 2, 3]
+    assert dag.execute({"input": values})["total"] == 6
+    assert dag.execute({"input": values})["total"] == 6
+    assert len(calls) == 1
+
+    # an equal but distinct list is not assumed to be unchanged
+    assert dag.execute({"input": [1, 2, 3]})["total"] == 6
+    assert len(calls) == 2
+
+
+def test_node_param_names():
+    import functools
+    import inspect
+    from agentgraph import template_function
+
+    def full(a, b=1, *args, c, **kwargs):
+        pass
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    for func in [
+        add,
+        full,
+        lambda: None,
+        functools.partial(add, 1),
+        decorator(mul),
+        template_function("greeting", "{greeting} {name}!"),
+    ]:
+        node = Node("node", func)
+        assert set(node.param_names) == set(inspect.signature(func).parameters)
+
+
+def test_inline_node():
+    import threading
+
+    def current_thread(x):
+        return threading.current_thread()
+
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    dag.add_node(Node("inline", current_thread, inline=True))
+    dag.add_node(Node("pooled", current_thread))
+    dag.add_node(Node("after", current_thread, inline=True))
+    dag.add_edge("input", "inline", "x")
+    dag.add_edge("input", "pooled", "x")
+    dag.add_edge("pooled", "after", "x")
+
+    output = dag.execute_parallel({"input": 1})
+    assert output["inline"] is threading.current_thread()
+    assert output["after"] is threading.current_thread()
+    assert output["pooled"] is not threading.current_thread()
+
+
+def test_missing_input_after_execution():
+    graph = DAG()
+    graph.add_node(InputNode("input"))
+    graph.add_node(Node("double", lambda x: x * 2))
+    graph.add_edge("input", "double", "x")
+
+    assert graph.execute_parallel({"input": 1})["double"] == 2
+    assert graph.execute({"input": 1})["double"] == 2
+
+    for execute in [graph.execute, graph.execute_parallel]:
+        try:
+            execute({})
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Should have raised a ValueError!")
+
+    try:
+        graph.execute({"input": 1, "double": 2})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Should have raised a ValueError!")
+
+
+def test_execute_batch():
+    graph = SimpleGraph()
+
+    @graph.add_function
+    def upper(input):
+        return input.upper()
+
+    graph.add_template_function("greeting", "{upper} {input}!")
+
+    rows = [{"input": "hello"}, {"input": "world"}]
+    outputs = graph.execute_batch(rows)
+    assert [output["greeting"] for output in outputs] == [
+        "HELLO hello!",
+        "WORLD world!",
+    ]
+    assert outputs[0] == graph.execute({"input": "hello"})
+    assert graph.execute_batch([]) == []
+
+
+def test_dag_prepare():
+    graph = DAG()
+    graph.add_node(InputNode("input"))
+    graph.add_node(Node("double", lambda x: x * 2))
+    graph.add_edge("input", "double", "x")
+    graph.prepare()
+
+    try:
+        graph.add_node(Node("triple", lambda x: x * 3))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Should have raised a ValueError!")
+
+    try:
+        graph.add_edge("input", "double", "x")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Should have raised a ValueError!")
+
+    assert graph.execute({"input": 2})["double"] == 4
+    assert graph.execute_parallel({"input": 3})["double"] == 6
+
+
+def test_dag_modified_after_execution():
+    graph = DAG()
+    graph.add_node(InputNode("input"))
+    graph.add_node(Node("double", lambda x: x * 2))
+    graph.add_edge("input", "double", "x")
+    assert graph.execute({"input": 2}) == {"input": 2, "double": 4}
+
+    graph.add_node(Node("triple", lambda x: x * 3))
+    graph.add_edge("double", "triple", "x")
+    assert graph.execute({"input": 2}) == {"input": 2, "double": 4, "triple": 12}
+
+
+def test_execute_selected_outputs():
+    import weakref
+
+    class Payload:
+        pass
+
+    refs = []
+
+    def make(x):
+        payload = Payload()
+        refs.append(weakref.ref(payload))
+        return payload
+
+    graph = DAG()
+    graph.add_node(InputNode("input"))
+    graph.add_node(Node("make", make))
+    graph.add_node(Node("consume", lambda x: 1))
+    graph.add_node(Node("check", lambda x: refs[-1]() is None))
+    graph.add_node(Node("side", lambda x: x))
+    graph.add_edge("input", "make", "x")
+    graph.add_edge("make", "consume", "x")
+    graph.add_edge("consume", "check", "x")
+    # a sibling branch, so that execute_parallel uses the thread pool
+    graph.add_edge("input", "side", "x")
+    assert not graph._get_plan().serial
+
+    # make's output is released once consume has read it
+    output = graph.execute({"input": 0}, outputs=["check", "side"])
+    assert output == {"check": True, "side": 0}
+    assert graph.execute({"input": 0})["check"] is False
+
+    output = graph.execute_parallel({"input": 0}, outputs=["check", "side"])
+    assert output == {"check": True, "side": 0}
+    assert graph.execute_parallel({"input": 0})["check"] is False
+
+    output = graph.execute_parallel({"input": 0}, outputs=["consume", "input"])
+    assert output == {"consume": 1, "input": 0}
+
+    try:
+        graph.execute({"input": 0}, outputs=["missing"])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Should have raised a ValueError!")
+
+
+def test_execute_selected_outputs_skips_other_nodes():
+    import asyncio
+
+    calls = []
+
+    def record(name):
+        def func(x):
+            calls.append(name)
+            return x + 1
+
+        return func
+
+    graph = DAG()
+    graph.add_node(InputNode("input"))
+    for name in ["a", "b", "c", "d"]:
+        graph.add_node(Node(name, record(name)))
+    graph.add_edge("input", "a", "x")
+    graph.add_edge("a", "b", "x")
+    graph.add_edge("input", "c", "x")
+    graph.add_edge("c", "d", "x")
+
+    for execute in [
+        graph.execute,
+        graph.execute_parallel,
+        lambda *args, **kwargs: asyncio.run(graph.execute_async(*args, **kwargs)),
+    ]:
+        calls.clear()
+        assert execute({"input": 0}, outputs=["b"]) == {"b": 2}
+        assert sorted(calls) == ["a", "b"]
+
+        calls.clear()
+        assert execute({"input": 0}, outputs=["a", "c"]) == {"a": 1, "c": 1}
+        assert sorted(calls) == ["a", "c"]
+
+
+def test_cacheable_node_cache_size():
+    calls = []
+
+    def double(x):
+        calls.append(x)
+        return x * 2
+
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    dag.add_node(Node("double", double, cacheable=True, cache_size=2))
+    dag.add_node(Node("increment", lambda x: calls.append(x) or x + 1, cacheable=True))
+    dag.add_edge("input", "double", "x")
+    dag.add_edge("double", "increment", "x")
+
+    for value in [1, 2, 1, 2]:
+        assert dag.execute({"input": value})["increment"] == value * 2 + 1
+    assert calls == [1, 2, 2, 4, 2, 4]
+
+    # 3 evicts the least recently used entry, which is 1
+    dag.execute({"input": 3})
+    del calls[:]
+    dag.execute({"input": 2})
+    dag.execute({"input": 1})
+    assert calls == [4, 1, 2]
+
+    del calls[:]
+    dag.invalidate_source("double")
+    dag.execute({"input": 1})
+    assert calls == [1, 2]
+
+
+def test_cacheable_node_cache_key():
+    calls = []
+
+    def answer(prompt):
+        calls.append(prompt)
+        return prompt.strip()
+
+    dag = DAG()
+    dag.add_node(InputNode("prompt"))
+    dag.add_node(
+        Node(
+            "answer",
+            answer,
+            cacheable=True,
+            cache_key=lambda prompt: prompt.strip().lower(),
+        )
+    )
+    dag.add_edge("prompt", "answer", "prompt")
+
+    assert dag.execute({"prompt": "Hello"})["answer"] == "Hello"
+    assert dag.execute({"prompt": " hello "})["answer"] == "Hello"
+    assert calls == ["Hello"]
+
+
+def test_shared_executor():
+    import threading
+
+    threads = []
+
+    def double(x):
+        threads.append(threading.current_thread().name)
+        return x * 2
+
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    dag.add_node(Node("output", double))
+    dag.add_node(Node("sibling", double))
+    dag.add_edge("input", "output", "x")
+    dag.add_edge("input", "sibling", "x")
+    assert not dag._get_plan().serial
+
+    assert dag.execute_parallel({"input": 1})["output"] == 2
+    executor = DAG._get_executor()
+    assert dag.execute_parallel({"input": 2})["output"] == 4
+    assert DAG._get_executor() is executor
+    assert all(name.startswith("agentgraph") for name in threads)
+
+    DAG.shutdown_executor()
+    assert dag.execute_parallel({"input": 3})["output"] == 6
+    assert DAG._get_executor() is not executor
+
+
+def test_shared_executor_concurrent_callers():
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    graph = SimpleGraph()
+
+    def upper(input):
+        time.sleep(0.2)
+        return input.upper()
+
+    def lower(input):
+        time.sleep(0.2)
+        return input.lower()
+
+    def final(upper, lower):
+        return upper + " " + lower
+
+    graph.add_functions([upper, lower, final])
+    graph.execute_parallel({"input": "HeLlO"})
+
+    # ten callers sharing the pool should not queue behind each other
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        futures = [
+            executor.submit(graph.execute_parallel, {"input": f"HeLlO {i}"})
+            for i in range(10)
+        ]
+        results = [future.result()["final"] for future in futures]
+    assert time.time() - start_time < 0.6
+    assert results[3] == "HELLO 3 hello 3"
+
+
+def test_dag_execute_async():
+    import asyncio
+    import time
+
+    async def fetch(query):
+        await asyncio.sleep(0.1)
+        return query.upper()
+
+    def count(fetch):
+        return len(fetch)
+
+    dag = DAG()
+    dag.add_node(InputNode("query"))
+    for i in range(8):
+        dag.add_node(Node(f"fetch{i}", fetch))
+        dag.add_edge("query", f"fetch{i}", "query")
+    dag.add_node(Node("count", count, inline=True))
+    dag.add_edge("fetch0", "count", "fetch")
+
+    start_time = time.time()
+    output = asyncio.run(dag.execute_async({"query": "hello"}))
+    end_time = time.time()
+
+    assert output["fetch7"] == "HELLO"
+    assert output["count"] == 5
+    if end_time - start_time > 0.5:
+        raise AssertionError("Coroutine nodes did not run concurrently")
+
+
+def test_execute_does_not_add_edge_entries():
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    dag.add_node(Node("output", lambda x: x * 2))
+    dag.add_edge("input", "output", "x")
+
+    dag.execute({"input": 1})
+    dag.execute_parallel({"input": 1})
+    assert set(dag.forward_edges) == {"input"}
+    assert set(dag.inverse_edges) == {"output"}
+
+
+def test_add_edges():
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    dag.add_node(InputNode("input2"))
+    dag.add_node(Node("add", add))
+    dag.add_node(Node("mul", mul))
+    dag.add_edges([("add", "mul", "x"), ("input", "add", "x"), ("input2", "add", "y")])
+    dag.add_edge("input", "mul", "y")
+
+    assert len(dag.edges) == 4
+    assert dag.execute({"input": 3, "input2": 4})["mul"] == 21
+
+    dag = DAG()
+    dag.add_node(Node("add", add))
+    dag.add_node(Node("mul", mul))
+    try:
+        dag.add_edges([("add", "mul", "x"), ("mul", "add", "x")])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Expected ValueError for cycle")
+    assert len(dag.edges) == 0
+
+
+def test_aggregate_node_values_only():
+    graph = DAG()
+    graph.add_node(InputNode("input"))
+    graph.add_node(InputNode("input2"))
+    graph.add_node(InputNode("input3"))
+    graph.add_node(
+        AggregateNode("aggregate", lambda x: x * 2, lambda x: sum(x), values_only=True)
+    )
+    graph.add_edge("input3", "aggregate", "x")
+    graph.add_edge("input", "aggregate", "x")
+    graph.add_edge("input2", "aggregate", "x")
+
+    output = graph.execute({"input": 1, "input2": 2, "input3": 3})
+    assert output["aggregate"] == 12
+
+    seen = []
+    graph = DAG()
+    graph.add_node(InputNode("a"))
+    graph.add_node(InputNode("b"))
+    graph.add_node(
+        AggregateNode(
+            "joined", lambda x: x, lambda x: seen.append(x), values_only=True
+        )
+    )
+    graph.add_edge("b", "joined", "x")
+    graph.add_edge("a", "joined", "x")
+    graph.execute_parallel({"a": "A", "b": "B"})
+    assert seen == [["B", "A"]]
+
+
+def test_aggregate_node_values_only_cacheable():
+    calls = []
+
+    def aggregate_fn(x):
+        calls.append(x)
+        return sum(x)
+
+    graph = DAG()
+    graph.add_node(InputNode("a"))
+    graph.add_node(InputNode("b"))
+    graph.add_node(
+        AggregateNode(
+            "total", lambda x: x, aggregate_fn, cacheable=True, values_only=True
+        )
+    )
+    graph.add_edge("a", "total", "x")
+    graph.add_edge("b", "total", "x")
+
+    for _ in range(3):
+        assert graph.execute({"a": 1, "b": 2})["total"] == 3
+    assert graph.execute_parallel({"a": 1, "b": 2})["total"] == 3
+    assert calls == [[1, 2]]
+
+    assert graph.execute({"a": 2, "b": 1})["total"] == 3
+    assert calls == [[1, 2], [2, 1]]
+
+
+def test_execute_parallel_with_executor():
+    from concurrent.futures import ThreadPoolExecutor
+
+    def double(x):
+        return x * 2
+
+    graph = SimpleGraph()
+    graph.add_function(double)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        output = graph.execute_parallel({"x": 4}, executor=executor)
+        assert output["double"] == 8
+        assert graph.execute_batch([{"x": 1}, {"x": 2}], executor=executor) == [
+            {"x": 1, "double": 2},
+            {"x": 2, "double": 4},
+        ]
+        # the executor is left running for the caller to shut down
+        assert executor.submit(double, 3).result() == 6
+
+
+def test_execute_parallel_with_process_pool():
+    from concurrent.futures import ProcessPoolExecutor
+
+    dag = DAG()
+    dag.add_node(InputNode("x"))
+    dag.add_node(InputNode("y"))
+    dag.add_node(Node("add", add))
+    # only the node's name, function and inputs are sent to the worker, so node
+    # attributes such as a lambda cache_key need not be picklable
+    dag.add_node(Node("mul", mul, cacheable=True, cache_key=lambda x, y: (x, y)))
+    dag.add_edge("x", "add", "x")
+    dag.add_edge("y", "add", "y")
+    dag.add_edge("add", "mul", "x")
+    dag.add_edge("y", "mul", "y")
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        output = dag.execute_parallel({"x": 2, "y": 3}, executor=executor)
+        assert output["mul"] == 15
+        output = dag.execute_parallel({"x": 2, "y": 3}, executor=executor)
+        assert output["mul"] == 15
+
+
+def test_execute_parallel_critical_path_first():
+    from concurrent.futures import ThreadPoolExecutor
+
+    started = []
+
+    def step(name):
+        def run(x):
+            started.append(name)
+            return x
+
+        return run
+
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    for name in ["short", "long1", "long2", "long3"]:
+        dag.add_node(Node(name, step(name)))
+    dag.add_edge("input", "short", "x")
+    dag.add_edge("input", "long1", "x")
+    dag.add_edge("long1", "long2", "x")
+    dag.add_edge("long2", "long3", "x")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        dag.execute_parallel({"input": 1}, executor=executor)
+    assert started[0] == "long1"
+
+
+def test_execute_parallel_serial_graph():
+    import threading
+
+    def current_thread(x):
+        return threading.current_thread()
+
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    dag.add_node(Node("first", lambda x: x + 1))
+    dag.add_node(Node("second", current_thread))
+    dag.add_edge("input", "first", "x")
+    dag.add_edge("first", "second", "x")
+    assert dag.execute_parallel({"input": 1})["second"] is threading.current_thread()
+
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    dag.add_node(Node("first", lambda x: x + 1))
+    dag.add_node(Node("second", current_thread))
+    dag.add_edge("input", "first", "x")
+    dag.add_edge("input", "second", "x")
+    assert dag.execute_parallel({"input": 1})["second"] is not threading.current_thread()
+
+
+def test_execute_compiled_steps():
+    calls = []
+
+    def cached(x):
+        calls.append(x)
+        return x + 1
+
+    dag = DAG()
+    dag.add_node(InputNode(("input", 1)))
+    dag.add_node(InputNode(("input", 2)))
+    dag.add_node(Node("add", add))
+    dag.add_node(Node("cached", cached, cacheable=True))
+    dag.add_node(AggregateNode("total", lambda x: x, lambda x: sum(x.values())))
+    dag.add_edge(("input", 1), "add", "x")
+    dag.add_edge(("input", 2), "add", "y")
+    dag.add_edge("add", "cached", "x")
+    dag.add_edge("add", "total", "x")
+    dag.add_edge("cached", "total", "x")
+
+    for _ in range(2):
+        output = dag.execute({("input", 1): 2, ("input", 2): 2})
+        assert output == {
+            ("input", 1): 2,
+            ("input", 2): 2,
+            "add": 4,
+            "cached": 5,
+            "total": 9,
+        }
+    assert calls == [4]
+
+    try:
+        dag.execute({("input", 1): 2, ("input", 2): "a"})
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("Should have raised a TypeError!")
+
+
+def test_execute_argument_order():
+    import dis
+
+    def subtract(x, y, scale=1):
+        return (x - y) * scale
+
+    def keyword_only(x, *, y):
+        return x - y
+
+    def positional_only(x, y, /):
+        return x - y
+
+    def build(func):
+        dag = DAG()
+        dag.add_node(InputNode("input1"))
+        dag.add_node(InputNode("input2"))
+        dag.add_node(Node("subtract", func))
+        # edges added in the reverse of the parameter order
+        dag.add_edge("input2", "subtract", "y")
+        dag.add_edge("input1", "subtract", "x")
+        return dag
+
+    def keyword_calls(dag):
+        return [
+            instruction.opname
+            for instruction in dis.get_instructions(dag._get_plan().run)
+            if instruction.opname
+            in ("KW_NAMES", "CALL_KW", "CALL_FUNCTION_KW", "CALL_FUNCTION_EX")
+        ]
+
+    dag = build(subtract)
+    assert dag.execute({"input1": 5, "input2": 3})["subtract"] == 2
+    assert keyword_calls(dag) == []
+
+    dag = build(keyword_only)
+    assert dag.execute({"input1": 5, "input2": 3})["subtract"] == 2
+    assert keyword_calls(dag) != []
+
+    dag = build(positional_only)
+    try:
+        dag.execute({"input1": 5, "input2": 3})
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("Should have raised a TypeError!")
+
+
+def test_missing_edge_detected_before_execution():
+    calls = []
+
+    def first(x):
+        calls.append(x)
+        return x
+
+    def second(first, y, z=1, *, w=2):
+        return first + y + z + w
+
+    dag = DAG()
+    dag.add_node(InputNode("input"))
+    dag.add_node(Node("first", first))
+    dag.add_node(Node("second", second))
+    dag.add_edge("input", "first", "x")
+    dag.add_edge("first", "second", "first")
+
+    try:
+        dag.execute({"input": 1})
+    except TypeError as e:
+        assert "y" in str(e)
+    else:
+        raise AssertionError("Should have raised a TypeError!")
+    assert calls == []
+
+    dag.add_edge("input", "second", "y")
+    assert dag.execute({"input": 1})["second"] == 5
+
+
+def test_missing_edge_errors_are_repeatable():
+    dag = DAG()
+    dag.add_node(Node("a", lambda x: x))
+    for _ in range(2):
+        try:
+            dag.execute({})
+        except ValueError as e:
+            assert str(e) == "a has no incoming edge and is not an input node"
+        else:
+            raise AssertionError("Should have raised a ValueError!")
+
+    graph = SimpleGraph()
+
+    def combine(query, other):
+        return query + other
+
+    graph.add_function(combine)
+    for _ in range(2):
+        try:
+            graph.execute({"query": "Hello"})
+        except TypeError as e:
+            assert "other" in str(e)
+        else:
+            raise AssertionError("Should have raised a TypeError!")
+
+
+def test_error_message_is_bounded():
+    import functools
+
+    dag = DAG()
+    dag.add_node(InputNode("prompt"))
+    dag.add_node(Node("broken", lambda prompt: prompt + 1))
+    dag.add_edge("prompt", "broken", "prompt")
+
+    try:
+        dag.execute({"prompt": "x" * 10000})
+    except TypeError as e:
+        assert "broken got error calling" in str(e)
+        assert len(str(e)) < 1000
+    else:
+        raise AssertionError("Should have raised a TypeError!")
+
+    node = Node("broken", lambda prompt: prompt + 1)
+    try:
+        node.execute("x" * 10000)
+    except TypeError as e:
+        assert "broken got error calling" in str(e)
+        assert len(str(e)) < 1000
+    else:
+        raise AssertionError("Should have raised a TypeError!")
+
+    # partials have no __name__
+    def translate(language, prompt):
+        return "Translate to " + language + ": " + prompt
+
+    dag = DAG()
+    dag.add_node(InputNode("prompt"))
+    dag.add_node(Node("translate", functools.partial(translate, "Spanish")))
+    dag.add_edge("prompt", "translate", "prompt")
+    try:
+        dag.execute({"prompt": 1})
+    except TypeError as e:
+        assert "translate got error calling functools.partial(" in str(e)
+    else:
+        raise AssertionError("Should have raised a TypeError!")
+
+
+def test_nested_execute_parallel():
+    import threading
+    import time
+
+    inner = DAG()
+    inner.add_node(InputNode("input"))
+    inner.add_node(Node("left", lambda x: time.sleep(0.05) or x))
+    inner.add_node(Node("right", lambda x: time.sleep(0.05) or x))
+    inner.add_edge("input", "left", "x")
+    inner.add_edge("input", "right", "x")
+
+    outer = DAG()
+    outer.add_node(InputNode("input"))
+    for i in range(40):
+        outer.add_node(
+            Node(f"inner{i}", lambda x: inner.execute_parallel({"input": x})["left"])
+        )
+        outer.add_edge("input", f"inner{i}", "x")
+
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(outer.execute_parallel({"input": 1}))
+    )
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout=30)
+    if not results:
+        raise AssertionError("Nested execute_parallel deadlocked")
+    assert results[0]["inner39"] == 1
+
+
+def test_two_level_nested_execute_parallel():
+    import threading
+    import time
+
+    inner = DAG()
+    inner.add_node(InputNode("input"))
+    inner.add_node(Node("left", lambda x: time.sleep(0.01) or x))
+    inner.add_node(Node("right", lambda x: time.sleep(0.01) or x))
+    inner.add_edge("input", "left", "x")
+    inner.add_edge("input", "right", "x")
+
+    middle = DAG()
+    middle.add_node(InputNode("input"))
+    for name in ["left", "right"]:
+        middle.add_node(
+            Node(name, lambda x: inner.execute_parallel({"input": x})["left"])
+        )
+        middle.add_edge("input", name, "x")
+
+    outer = DAG()
+    outer.add_node(InputNode("input"))
+    for i in range(40):
+        outer.add_node(
+            Node(f"middle{i}", lambda x: middle.execute_parallel({"input": x})["left"])
+        )
+        outer.add_edge("input", f"middle{i}", "x")
+
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(outer.execute_parallel({"input": 1}))
+    )
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout=30)
+    if not results:
+        raise AssertionError("Two level nested execute_parallel deadlocked")
+    assert results[0]["middle39"] == 1
+
+
+def test_aggregate_node_identity_func():
+    def aggregate_fn(x):
+        return sorted(x.values())
+
+    node = AggregateNode("aggregate", lambda x: x, aggregate_fn)
+    assert node.invoker() is aggregate_fn
+    node = AggregateNode("aggregate", lambda x: len(x), aggregate_fn)
+    assert node.invoker() is not aggregate_fn
+    assert node.invoker()(x={"a": 1, "b": 2}) == 2
+
+
+def test_node_param_names_partial():
+    import functools
+
+    def translate(language, input):
+        return language + ": " + input
+
+    node = Node("spanish", functools.partial(translate, "Spanish"))
+    assert node.param_names == ("input",)
+    node = Node("spanish", functools.partial(translate, language="Spanish"))
+    assert node.param_names == ("language", "input")
+
+
+def test_aggregate_node_reserved_argument_names():
+    def aggregate_fn(func, aggregate_func):
+        return sum(func.values()) + sum(aggregate_func.values())
+
+    def processing_fn(func, aggregate_func=None):
+        return func * 2
+
+    dag = DAG()
+    dag.add_node(InputNode("input1"))
+    dag.add_node(InputNode("input2"))
+    dag.add_node(AggregateNode("aggregate", processing_fn, aggregate_fn))
+    dag.add_edge("input1", "aggregate", "func")
+    dag.add_edge("input2", "aggregate", "aggregate_func")
+
+    assert dag.execute({"input1": 1, "input2": 2})["aggregate"] == 6
+    output = dag.execute_parallel({"input1": 1, "input2": 2})
+    assert output["aggregate"] == 6